@@ -0,0 +1,59 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True
+"""Cython version of csp_solver.propagate_all_different(), the AC-3
+propagation of a CSP whose constraints are all Alldiff constraints, over
+arrays of bitmasks.
+"""
+
+
+cdef inline bint revise_all_different(long long* domains, int i,
+                                      long long mask) nogil:
+    """Removes the single value in 'mask' from the domain of variable 'i'.
+    Returns true if the domain was revised.
+    """
+    if domains[i] & mask:
+        domains[i] &= ~mask
+        return True
+    return False
+
+
+cdef bint propagate(long long* domains, int n, int* nbr_ptr, int* nbr_idx,
+                    int* queue, unsigned char* in_queue,
+                    int queue_length) nogil:
+    """Runs the queue of variables until it is empty, and returns false as
+    soon as a variable is left without legal values.
+    """
+    cdef int head = 0
+    cdef int i, j, k
+    cdef long long mask
+    while queue_length > 0:
+        j = queue[head]
+        head = (head + 1) % n
+        queue_length -= 1
+        in_queue[j] = 0
+        mask = domains[j]
+        # only a single value left for j can remove values
+        if mask & (mask - 1):
+            continue
+        for k in range(nbr_ptr[j], nbr_ptr[j + 1]):
+            i = nbr_idx[k]
+            if revise_all_different(domains, i, mask):
+                if domains[i] == 0:
+                    return False
+                if not in_queue[i]:
+                    queue[(head + queue_length) % n] = i
+                    queue_length += 1
+                    in_queue[i] = 1
+    return True
+
+
+def propagate_all_different(long long[::1] domains, int[::1] nbr_ptr,
+                            int[::1] nbr_idx, int[::1] queue,
+                            unsigned char[::1] in_queue, int queue_length):
+    """See csp_solver.propagate_all_different().
+    """
+    cdef bint consistent
+    with nogil:
+        consistent = propagate(&domains[0], domains.shape[0], &nbr_ptr[0],
+                               &nbr_idx[0], &queue[0], &in_queue[0],
+                               queue_length)
+    return consistent
@@ -0,0 +1,221 @@
+/*
+ * A C version of the search that BitmaskCSP runs on a Sudoku board with
+ * its default strategies: AC-3 on the Alldiff constraints, the degree
+ * heuristic for the first variable and the minimum remaining values
+ * heuristic after that, and the least constraining value ordering.
+ *
+ * The board is stored as 81 bitmasks of 9 bits, where bit k means that
+ * the value k + 1 is still legal for the cell. Making the Alldiff arcs
+ * consistent only means removing the value of every cell with a single
+ * legal value from its 20 neighbours, so the result of the propagation,
+ * and with it the number of calls to backtrack, is the same as in
+ * csp_solver.
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#include <stdint.h>
+#include <string.h>
+
+#define CELLS 81
+#define NEIGHBOURS 20
+
+/* neighbours[k] are the cells that share a row, column or box with k */
+static int neighbours[CELLS][NEIGHBOURS];
+
+typedef struct {
+    uint16_t domains[CELLS];
+    /* the domains of every expanded cell before it was assigned, one
+     * checkpoint per level of the search */
+    uint16_t checkpoints[CELLS + 1][CELLS];
+    Py_ssize_t calls;
+    Py_ssize_t failures;
+} search_t;
+
+static void build_neighbours(void)
+{
+    for (int k = 0; k < CELLS; k++) {
+        int row = k / 9, col = k % 9, count = 0;
+        for (int other = 0; other < CELLS; other++) {
+            int other_row = other / 9, other_col = other % 9;
+            if (other != k && (other_row == row || other_col == col ||
+                    (other_row / 3 == row / 3 && other_col / 3 == col / 3)))
+                neighbours[k][count++] = other;
+        }
+    }
+}
+
+static int is_single(uint16_t mask)
+{
+    return (mask & (mask - 1)) == 0;
+}
+
+/* Removes the value of every cell in 'queue' from its neighbours, adding
+ * the neighbours that are left with a single value to the queue. Returns
+ * 0 if a cell is left without legal values. */
+static int propagate(uint16_t *domains, int *queue, int length)
+{
+    for (int head = 0; head < length; head++) {
+        int cell = queue[head];
+        uint16_t value = domains[cell];
+        for (int n = 0; n < NEIGHBOURS; n++) {
+            int other = neighbours[cell][n];
+            uint16_t mask = domains[other];
+            if (!(mask & value))
+                continue;
+            mask &= ~value;
+            if (mask == 0)
+                return 0;
+            domains[other] = mask;
+            if (is_single(mask))
+                queue[length++] = other;
+        }
+    }
+    return 1;
+}
+
+/* The cell with the fewest legal values left, preferring the lowest index
+ * as the heap of mrv_heuristic() does, or -1 if every cell is decided. On
+ * the first call the degree heuristic is used instead, which picks the
+ * first undecided cell as all cells have the same number of
+ * constraints. */
+static int select_cell(const uint16_t *domains, int first)
+{
+    int best = -1, best_size = 10;
+    for (int k = 0; k < CELLS; k++) {
+        int size = __builtin_popcount(domains[k]);
+        if (size > 1 && size < best_size) {
+            best = k;
+            best_size = size;
+            if (first)
+                break;
+        }
+    }
+    return best;
+}
+
+/* The values of 'cell', sorted by the number of neighbours that still
+ * have them as a legal value. Returns the number of values. */
+static int order_values(const uint16_t *domains, int cell, int *values)
+{
+    int counts[9], length = 0;
+    for (int value = 0; value < 9; value++) {
+        if (!(domains[cell] >> value & 1))
+            continue;
+        int count = 0;
+        for (int n = 0; n < NEIGHBOURS; n++)
+            count += domains[neighbours[cell][n]] >> value & 1;
+        /* insertion sort, which keeps equal counts in increasing order of
+         * the values like sorted() */
+        int k = length++;
+        while (k > 0 && counts[k - 1] > count) {
+            counts[k] = counts[k - 1];
+            values[k] = values[k - 1];
+            k--;
+        }
+        counts[k] = count;
+        values[k] = value;
+    }
+    return length;
+}
+
+static int backtrack(search_t *search, int depth)
+{
+    uint16_t *domains = search->domains;
+    int values[9], queue[CELLS];
+
+    search->calls++;
+    int cell = select_cell(domains, search->calls == 1);
+    if (cell < 0)
+        return 1;
+
+    memcpy(search->checkpoints[depth], domains, sizeof(search->domains));
+    int length = order_values(domains, cell, values);
+    for (int k = 0; k < length; k++) {
+        domains[cell] = (uint16_t)(1 << values[k]);
+        queue[0] = cell;
+        if (propagate(domains, queue, 1) && backtrack(search, depth + 1))
+            return 1;
+        memcpy(domains, search->checkpoints[depth], sizeof(search->domains));
+    }
+    search->failures++;
+    return 0;
+}
+
+static PyObject *solve(PyObject *self, PyObject *args)
+{
+    const char *board;
+    Py_ssize_t size;
+    if (!PyArg_ParseTuple(args, "y#", &board, &size))
+        return NULL;
+    if (size != CELLS) {
+        PyErr_SetString(PyExc_ValueError, "the board must have 81 cells");
+        return NULL;
+    }
+
+    search_t *search = PyMem_Calloc(1, sizeof(search_t));
+    if (search == NULL)
+        return PyErr_NoMemory();
+
+    int queue[CELLS], length = 0;
+    for (int k = 0; k < CELLS; k++) {
+        if (board[k] < '0' || board[k] > '9') {
+            PyMem_Free(search);
+            PyErr_SetString(PyExc_ValueError,
+                "the cells of the board must be digits");
+            return NULL;
+        }
+        if (board[k] == '0') {
+            search->domains[k] = 0x1FF;
+        } else {
+            search->domains[k] = (uint16_t)(1 << (board[k] - '1'));
+            queue[length++] = k;
+        }
+    }
+
+    int solved;
+    Py_BEGIN_ALLOW_THREADS
+    /* the initial inference on every arc only has to start from the given
+     * cells, as the other cells have every value */
+    solved = propagate(search->domains, queue, length) &&
+        backtrack(search, 0);
+    Py_END_ALLOW_THREADS
+
+    PyObject *solution;
+    if (solved) {
+        char digits[CELLS];
+        for (int k = 0; k < CELLS; k++)
+            digits[k] = (char)('0' + __builtin_ctz(search->domains[k]) + 1);
+        solution = PyBytes_FromStringAndSize(digits, CELLS);
+        if (solution == NULL) {
+            PyMem_Free(search);
+            return NULL;
+        }
+    } else {
+        Py_INCREF(Py_None);
+        solution = Py_None;
+    }
+    PyObject *result = Py_BuildValue("(Nnn)", solution, search->calls,
+        search->failures);
+    PyMem_Free(search);
+    return result;
+}
+
+static PyMethodDef methods[] = {
+    {"solve", solve, METH_VARARGS,
+     "solve(board) -> (solution, calls, failures)\n\n"
+     "Solve the Sudoku 'board', given as 81 bytes of digits with '0' for\n"
+     "the empty cells. Returns the solved board in the same format, or\n"
+     "None, and the number of calls to backtrack and of failures."},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef module = {
+    PyModuleDef_HEAD_INIT, "_sudoku_csolve", NULL, -1, methods
+};
+
+PyMODINIT_FUNC PyInit__sudoku_csolve(void)
+{
+    build_neighbours();
+    return PyModule_Create(&module);
+}
@@ -1,8 +1,39 @@
-import copy
+import array
+import heapq
 import itertools
+import operator
+from collections import Counter
+
+try:
+    from . import _ac3
+except ImportError:
+    _ac3 = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# The filter function of a constraint that two variables have different
+# values. add_constraint_one_way() recognizes it, and stores the constraint
+# as an Alldiff arc whose value pairs are shared with the other arcs
+NEQ = operator.ne
 
 
 class CSP:
+    # the attributes set in __init__(), which are stored in slots instead
+    # of a dictionary for every instance
+    __slots__ = ('variables', 'domains', 'constraints', 'value_supports',
+        'all_different_arcs', 'shared_constraints', 'shared_value_supports',
+        'neighboring_arcs', 'edges_to', 'backtrack_calls_count',
+        'backtrack_returns_failure_count', 'unassigned_count', 'mrv_heap',
+        'variable_index', 'select_unassigned_strategy_static',
+        'select_unassigned_strategy_mrv', 'select_unassigned_strategy_degree',
+        'order_domain_values_strategy_static',
+        'order_domain_values_strategy_least_constraint',
+        'inference_strategy_ac4', 'supports', 'support_counters')
+
     def __init__(self):
         # self.variables is a list of the variable names in the CSP
         self.variables = []
@@ -10,14 +41,49 @@ class CSP:
         # self.domains[i] is a list of legal values for variable i
         self.domains = {}
 
-        # self.constraints[i][j] is a list of legal value pairs for
+        # self.constraints[i][j] is a set of legal value pairs for
         # the variable pair (i, j)
         self.constraints = {}
 
+        # self.value_supports[i][j][x] is the set of values y of variable
+        # j such that (x, y) is a legal value pair for (i, j)
+        self.value_supports = {}
+
+        # self.all_different_arcs is a set of the arcs (i, j) whose only
+        # constraint is that i and j have different values
+        self.all_different_arcs = set()
+
+        # self.shared_constraints maps the domains of a pair of variables
+        # to the Alldiff constraint between them (see
+        # get_all_different_constraint()), and self.shared_value_supports
+        # maps a shared set of pairs and the domain of i to the
+        # corresponding self.value_supports[i][j], so that arcs with the
+        # same constraint share the same objects
+        self.shared_constraints = {}
+        self.shared_value_supports = {}
+
+        # caches of the arcs returned by get_all_neighboring_arcs() and
+        # get_edges_to(), which are cleared whenever a constraint is added
+        self.neighboring_arcs = {}
+        self.edges_to = {}
+
         # counters to compare results
         self.backtrack_calls_count = 0
         self.backtrack_returns_failure_count = 0
 
+        # the number of variables with more than one legal value left in
+        # the assignment of the running search, which is kept up to date
+        # as values are removed and restored so that is_complete() does
+        # not have to look at every variable
+        self.unassigned_count = 0
+
+        # a heap of (number of legal values, index, variable) entries used
+        # by mrv_heuristic(). An entry is pushed whenever the number of
+        # legal values of a variable changes, and the entries that are out
+        # of date are only thrown away once they reach the top of the heap
+        self.mrv_heap = []
+        self.variable_index = {}
+
         # strategies for selecting unassigned variable
         self.select_unassigned_strategy_static = False
         self.select_unassigned_strategy_mrv = True
@@ -27,6 +93,19 @@ class CSP:
         self.order_domain_values_strategy_static = False
         self.order_domain_values_strategy_least_constraint = True
 
+        # strategies for inference: AC-3 is used unless AC-4 is selected.
+        # AC-4 works on lists of legal values, so it is only available
+        # for CSP: BitmaskCSP raises a ValueError when it is selected
+        self.inference_strategy_ac4 = False
+
+        # self.supports[(j, y)] is a list of the (i, x) pairs such that
+        # value y of variable j supports value x of variable i, and
+        # self.support_counters[(i, j, x)] is the number of legal values
+        # of j that support value x of i. Both are set up by
+        # initialize_supports() when AC-4 is selected
+        self.supports = {}
+        self.support_counters = {}
+
     def add_variable(self, name, domain):
         """Add a new variable to the CSP. 'name' is the variable name
         and 'domain' is a list of the legal values for the variable.
@@ -34,6 +113,16 @@ class CSP:
         self.variables.append(name)
         self.domains[name] = list(domain)
         self.constraints[name] = {}
+        self.value_supports[name] = {}
+
+    def add_variables_bulk(self, names, domains):
+        """Add all the variables in the list 'names' to the CSP at once,
+        where domains[k] is a list of the legal values for names[k].
+        """
+        self.variables.extend(names)
+        self.domains.update(zip(names, map(list, domains)))
+        self.constraints.update((name, {}) for name in names)
+        self.value_supports.update((name, {}) for name in names)
 
     def get_all_possible_pairs(self, a, b):
         """Get a list of all possible pairs (as tuples) of the values in
@@ -49,11 +138,24 @@ class CSP:
         """
         return [(i, j) for i in self.constraints for j in self.constraints[i]]
 
+    def get_initial_arcs(self, assignment):
+        """Get the arcs that AC-3 has to start from to make 'assignment'
+        arc-consistent, i.e. all the arcs of get_all_arcs() except for the
+        Alldiff arcs (i, j) where j has more than one legal value, as
+        revising them can not remove any value of i.
+        """
+        return [(i, j) for (i, j) in self.get_all_arcs()
+            if (i, j) not in self.all_different_arcs
+            or self.get_domain_size(assignment[j]) <= 1]
+
     def get_all_neighboring_arcs(self, var):
         """Get a list of all arcs/constraints going to/from variable
         'var'. The arcs/constraints are represented as in get_all_arcs().
         """
-        return [(i, var) for i in self.constraints[var]]
+        if var not in self.neighboring_arcs:
+            self.neighboring_arcs[var] = tuple(
+                (i, var) for i in self.constraints[var])
+        return list(self.neighboring_arcs[var])
 
     def add_constraint_one_way(self, i, j, filter_function):
         """Add a new constraint between variables 'i' and 'j'. The legal
@@ -63,48 +165,139 @@ class CSP:
         from i -> j. NB!: Ensure that the function also gets called
         to add the constraint the other way, j -> i, as all constraints
         are supposed to be two-way connections.
+
+        If 'filter_function' is NEQ, the arc becomes an Alldiff arc unless
+        it already has another constraint.
         """
-        if not j in self.constraints[i]:
-            # First, get a list of all possible pairs of values between
-            # variables i and j
-            self.constraints[i][j] = self.get_all_possible_pairs(
+        if filter_function is NEQ:
+            if (i, j) in self.all_different_arcs:
+                # an arc that already is an Alldiff arc (e.g. between two
+                # cells in the same row and box of a Sudoku) stays the same
+                return
+            if j not in self.constraints[i]:
+                self.add_shared_constraint(i, j,
+                    self.get_all_different_constraint(i, j))
+                self.all_different_arcs.add((i, j))
+                return
+
+        # The arc is no longer a plain Alldiff arc once another constraint
+        # has been added to it
+        self.all_different_arcs.discard((i, j))
+        self.neighboring_arcs.clear()
+        self.edges_to.clear()
+
+        if j in self.constraints[i]:
+            candidates = self.constraints[i][j]
+        else:
+            # First, get all possible pairs of values between variables i
+            # and j
+            candidates = self.get_all_possible_pairs(
                 self.domains[i], self.domains[j])
 
-        # Next, filter this list of value pairs through the function
-        # 'filter_function', so that only the legal value pairs remain
-        self.constraints[i][j] = list(filter(lambda value_pair: 
-            filter_function(*value_pair), self.constraints[i][j]))
+        # Next, filter these value pairs through the function
+        # 'filter_function', so that only the legal value pairs remain.
+        # They are stored as a set so that checking whether a pair is
+        # legal is a constant time lookup, and grouped by the value of i
+        pairs = set()
+        supports = {x: set() for x in self.domains[i]}
+        for (x, y) in candidates:
+            if filter_function(x, y):
+                pairs.add((x, y))
+                supports[x].add(y)
+        self.constraints[i][j] = pairs
+        self.value_supports[i][j] = supports
+
+    def add_shared_constraint(self, i, j, pairs):
+        """Add a new constraint between variables 'i' and 'j' whose legal
+        value pairs are the frozenset 'pairs'. Unlike
+        add_constraint_one_way(), the pairs are not copied, so the same
+        frozenset can be shared by every arc with the same constraint.
+        This function only adds the constraint one way, from i -> j.
+        """
+        self.all_different_arcs.discard((i, j))
+        self.neighboring_arcs.clear()
+        self.edges_to.clear()
+
+        key = (pairs, tuple(self.domains[i]))
+        if key not in self.shared_value_supports:
+            supports = {x: set() for x in self.domains[i]}
+            for (x, y) in pairs:
+                supports[x].add(y)
+            self.shared_value_supports[key] = supports
+        self.constraints[i][j] = pairs
+        self.value_supports[i][j] = self.shared_value_supports[key]
+
+    def get_all_different_constraint(self, i, j):
+        """Get the frozenset of the value pairs of variables 'i' and 'j'
+        with different values, which is built once for every pair of
+        domains and shared by all the arcs between variables with these
+        domains.
+        """
+        key = (tuple(self.domains[i]), tuple(self.domains[j]))
+        if key not in self.shared_constraints:
+            self.shared_constraints[key] = frozenset((x, y) for (x, y) in
+                self.get_all_possible_pairs(self.domains[i], self.domains[j])
+                if x != y)
+        return self.shared_constraints[key]
 
     def add_all_different_constraint(self, variables):
         """Add an Alldiff constraint between all of the variables in the
         list 'variables'.
         """
-        for (i, j) in self.get_all_possible_pairs(variables, variables):
-            if i != j:
-                self.add_constraint_one_way(i, j, lambda x, y: x != y)
+        for (i, j) in itertools.permutations(variables, 2):
+            self.add_constraint_one_way(i, j, NEQ)
+
+    def copy_domains(self):
+        """Get a copy of the dictionary of the domains of the variables,
+        with a new list of legal values for every variable.
+        """
+        return {var: domain[:] for (var, domain) in self.domains.items()}
 
     def backtracking_search(self):
         """Starts the CSP solver and returns the found solution.
         """
-        # Make a so-called "deep copy" of the dictionary containing the
-        # domains of the CSP variables. The deep copy is required to
-        # ensure that any changes made to 'assignment' does not have any
-        # side effects elsewhere.
-        assignment = copy.deepcopy(self.domains)
+        # Make a copy of the dictionary containing the domains of the CSP
+        # variables. The copy is required to ensure that any changes made
+        # to 'assignment' does not have any side effects elsewhere.
+        assignment = self.copy_domains()
+
+        # The trail records every (variable, value) pair that is removed
+        # from 'assignment' during the search, so that the removals can be
+        # undone when backtracking instead of copying the assignment
+        trail = []
+
+        # the index of every variable, which is used to break ties between
+        # the variables with the fewest legal values in mrv_heuristic()
+        self.variable_index = {var: k for (k, var) in enumerate(assignment)}
 
-        # Run AC-3 on all constraints in the CSP, to weed out all of the
-        # values that are not arc-consistent to begin with
-        self.inference(assignment, self.get_all_arcs())
+        # Run AC-3 (or AC-4) on all constraints in the CSP, to weed out all
+        # of the values that are not arc-consistent to begin with. AC-3 only
+        # has to start from the arcs that can remove a value
+        if self.inference_strategy_ac4:
+            consistent = self.initialize_supports(assignment, trail)
+        else:
+            consistent = self.inference(assignment,
+                self.get_initial_arcs(assignment))
+        if not consistent:
+            return None
+
+        # count the variables that are left to be decided, and put them on
+        # the heap of mrv_heuristic()
+        self.unassigned_count = 0
+        self.mrv_heap = []
+        for var in assignment:
+            self.count_domain_change(var, 1,
+                self.get_domain_size(assignment[var]))
 
         # Call backtrack with the partial assignment 'assignment'
-        return self.backtrack(assignment)
+        return self.backtrack(assignment, trail)
 
-    def backtrack(self, assignment):
+    def backtrack(self, assignment, trail):
         """The function 'Backtrack' from the pseudocode in the
         textbook.
 
-        The function is called recursively, with a partial assignment of
-        values 'assignment'. 'assignment' is a dictionary that contains
+        The function starts from a partial assignment of values
+        'assignment'. 'assignment' is a dictionary that contains
         a list of all legal values for the variables that have *not* yet
         been decided, and a list of only a single value for the
         variables that *have* been decided.
@@ -115,52 +308,119 @@ class CSP:
         continues. When the function 'inference' is called to run
         the AC-3 algorithm, the lists of legal values in 'assignment'
         gets reduced as AC-3 discovers illegal values.
+
+        'assignment' is modified in place. Every value removed from it is
+        appended to the list 'trail', which is used to restore the
+        assignment when a value turns out to lead to a failure.
+
+        Instead of calling itself recursively, the function keeps an
+        explicit stack with one frame per expanded variable. A frame holds
+        the variable, an iterator over the values that are left to try and
+        the length of the trail when the variable was selected. Entering
+        a frame counts as a call to backtrack, and running out of values
+        in a frame counts as a failure.
         """
-        self.backtrack_calls_count += 1
-
-        # return if the assignment is complete
-        if self.is_complete(assignment):
-            return assignment
-
-        # select the next variable to expand
-        var = self.select_unassigned_variable(assignment)
-        for value in self.order_domain_values(var, assignment):
-            asg = copy.deepcopy(assignment)
-            # check that value is consistent with the assignment
-            if self.is_consistent(value, var, asg):
-                # add { var = value } to assignment
-                asg[var] = [value]
-                # perform AC-3 on the assignment passing as the queue all the
-                # edges of the selected variable with its neighbours
-                inferences = self.inference(asg, 
-                    self.get_all_neighboring_arcs(var))
-                # if the CSP is solved
-                if inferences:
-                    # the we call recursively call backtrack with the current 
-                    # assignment
-                    result = self.backtrack(asg)
-                    if result is not None:
-                        return result
-                # if failure, remove { var = value } from the assignment
-                if var in asg:
-                    del asg[var]
+        stack = []
+        descend = True
+        while descend:
+            self.backtrack_calls_count += 1
+
+            # return if the assignment is complete
+            if self.is_complete(assignment):
+                return assignment
+
+            # select the next variable to expand, remembering the length of
+            # the trail so that everything removed from the assignment while
+            # trying one of its values can be restored
+            var = self.select_unassigned_variable(assignment)
+            stack.append((var, iter(self.order_domain_values(var,
+                assignment)), len(trail)))
+
+            descend = False
+            while stack and not descend:
+                (var, values, mark) = stack[-1]
+                for value in values:
+                    # check that value is consistent with the assignment
+                    if self.is_consistent(value, var, assignment):
+                        # add { var = value } to assignment
+                        self.assign(assignment, var, value, trail)
+                        if self.inference_strategy_ac4:
+                            # perform AC-4 on the assignment passing the
+                            # values that were just removed from the
+                            # selected variable
+                            inferences = self.inference_ac4(assignment,
+                                trail[mark:], trail)
+                        else:
+                            # perform AC-3 on the assignment passing as the
+                            # queue all the edges of the selected variable
+                            # with its neighbours
+                            inferences = self.inference(assignment,
+                                self.get_all_neighboring_arcs(var), trail)
+                        # if the CSP is still consistent, continue the
+                        # search from the current assignment
+                        if inferences:
+                            descend = True
+                            break
+                        # if failure, remove { var = value } from the
+                        # assignment
+                        self.undo(assignment, trail, mark)
+                else:
+                    # the variable has no values left: count the failure and
+                    # remove the value of the previous variable that led here
+                    self.backtrack_returns_failure_count += 1
+                    stack.pop()
+                    if stack:
+                        self.undo(assignment, trail, stack[-1][2])
 
         # return failure if no solution is found
-        self.backtrack_returns_failure_count += 1
         return None
 
+    def assign(self, assignment, var, value, trail):
+        """Adds { var = value } to 'assignment', recording the values that
+        are no longer legal for variable 'var' on 'trail'.
+        """
+        self.count_domain_change(var, len(assignment[var]), 1)
+        for other in assignment[var]:
+            if other != value:
+                trail.append((var, other))
+        assignment[var] = [value]
+
+    def undo(self, assignment, trail, mark):
+        """Restores the values that have been removed from 'assignment'
+        since the trail had length 'mark', and shortens the trail back to
+        that length.
+        """
+        while len(trail) > mark:
+            (var, value) = trail.pop()
+            assignment[var].append(value)
+            self.count_domain_change(var, len(assignment[var]) - 1,
+                len(assignment[var]))
+            # the value supports its neighbours again
+            if self.inference_strategy_ac4:
+                for (i, x) in self.supports[(var, value)]:
+                    self.support_counters[(i, var, x)] += 1
+
+    def count_domain_change(self, var, old_size, new_size):
+        """Keeps 'unassigned_count' and the heap of mrv_heuristic() up to
+        date when the number of legal values of variable 'var' in the
+        running search changes from 'old_size' to 'new_size'.
+        """
+        if old_size > 1 >= new_size:
+            self.unassigned_count -= 1
+        elif new_size > 1 >= old_size:
+            self.unassigned_count += 1
+        if new_size > 1:
+            heapq.heappush(self.mrv_heap,
+                (new_size, self.variable_index[var], var))
+
     def is_complete(self, assignment):
         """Returns true if the assignment is complete, i.e. if all the 
         variables have been assigned exactly one value.
         """
-        # for all the variables in assignment
-        for var in assignment.values():
-            # if the variable does not have exactly one value, return false
-            if len(var) != 1:
-                return False
-        # if all variables have exactly one value, then the assignment is
-        # complete
-        return True
+        # the assignment is complete when no variable has more than one
+        # legal value left (a variable without legal values makes the
+        # inference fail before the search gets here)
+        return self.unassigned_count == 0
 
     def select_unassigned_variable(self, assignment):
         """The function 'Select-Unassigned-Variable' from the pseudocode
@@ -209,22 +469,15 @@ class CSP:
     def mrv_heuristic(self, asg):
         """Returns de variable that has the fewest legal values.
         """
-        min_var = None
-        min_value = None
-        # for all the variables in the assignment
-        for var in asg.keys():
-            # if the variable is not yet assigned, find the number of
-            # possible values
-            if len(asg[var]) > 1:
-                if min_var is None and min_value is None:
-                    min_var = var
-                    min_value = len(asg[var])
-                else:
-                    if min_value > len(asg[var]) > 1:
-                        min_var = var
-                        min_value = len(asg[var])
-        # return the variable with the lowest number of legal values
-        return min_var
+        # throw away the entries at the top of the heap that are out of
+        # date, or whose variable is already assigned
+        while self.mrv_heap:
+            (size, _, var) = self.mrv_heap[0]
+            if self.get_domain_size(asg[var]) == size:
+                # return the variable with the lowest number of legal values
+                return var
+            heapq.heappop(self.mrv_heap)
+        return None
 
     def order_domain_values(self, var, asg):
         """Returns a list of the domain values of the variable 'var' for
@@ -236,94 +489,626 @@ class CSP:
             return self.domains[var]
         # if least constraining value is selected
         elif self.order_domain_values_strategy_least_constraint:
-            # create a dictionary to keep track of the number of constraints
-            # for each value in the domain
-            domain_count = {}
-            for d in self.domains[var]:
-                count = 0
-                for c in self.constraints[var]:
-                    for values in asg[c]:
-                        if d in values:
-                            count += 1
-                domain_count[d] = count
+            # count in how many of the neighbours of var each value is
+            # still legal, going once over the domains of the neighbours
+            neighbor_counts = Counter()
+            for c in self.constraints[var]:
+                neighbor_counts.update(asg[c])
             # return a list of the values sorted from lowest to highest 
             # occurrences
-            return list(dict(sorted(domain_count.items(), 
-                key=lambda item: item[1])).keys())
+            return sorted(self.domains[var], key=lambda d: neighbor_counts[d])
 
     def is_consistent(self, val, var, asg):
         """Returns true if value 'val' is consistent with the assignment 'asg'.
         """
         # for all the variables that have a constraint with the
         # current variable 'var'
-        for var2 in self.constraints[var].keys():
-            is_consistent = False
-            # check if it exists a pair where 'value' appears for variable 
-            # 'var' and 'var2'
-            for val2 in asg[var2]:
-                if (val, val2) in self.constraints[var][var2]:
-                    is_consistent = True
-            # if only one pair does not exist return false
-            if not is_consistent:
+        for (var2, supports) in self.value_supports[var].items():
+            # check if there is a legal value left for 'var2' that forms a
+            # legal pair with 'val', stopping at the first one found. If
+            # there is none, return false
+            if supports[val].isdisjoint(asg[var2]):
                 return False
         # otherwise the value is consistent, and we return true
         return True
 
-    def inference(self, assignment, queue):
+    def inference(self, assignment, queue, trail=None):
         """The function 'AC-3' from the pseudocode in the textbook.
         'assignment' is the current partial assignment, that contains
         the lists of legal values for each undecided variable. 'queue'
-        is the initial queue of arcs that should be visited.
+        is the initial queue of arcs that should be visited. If 'trail'
+        is given, the removed values are recorded on it (see 'revise').
         """
+        # take the arcs out of 'queue' and into a priority queue, where the
+        # arcs (i, j) whose variable j has the fewest legal values are
+        # revised first, as they are the most likely to remove values.
+        # The counter keeps arcs with the same priority in the order they
+        # were queued, and the set of queued arcs makes checking whether
+        # an arc is already queued a constant time operation
+        counter = itertools.count()
+        pending = [(self.get_domain_size(assignment[j]), next(counter), (i, j))
+            for (i, j) in queue]
+        heapq.heapify(pending)
+        in_queue = set(queue)
+        queue.clear()
         # while we there are edges to revise
-        while len(queue) > 0:
-            (i, j) = queue.pop(0)
-            if self.revise(assignment, i, j):
+        while pending:
+            (_, _, (i, j)) = heapq.heappop(pending)
+            in_queue.discard((i, j))
+            if self.revise(assignment, i, j, trail):
                 # if i and j are not consistent, return false
-                if len(assignment[i]) == 0:
+                if not assignment[i]:
                     return False
-                # add the edges needed to re-revise
+                # add the edges needed to re-revise, which all go to i
+                size = self.get_domain_size(assignment[i])
                 for x in self.get_edges_to(i, exclude=j):
-                    if x not in queue:
-                        queue.append(x)
+                    if x not in in_queue:
+                        heapq.heappush(pending, (size, next(counter), x))
+                        in_queue.add(x)
         # when every edge has been revised (they are consistent), return true
         return True
 
+    def initialize_supports(self, assignment, trail):
+        """The initialization phase of the 'AC-4' algorithm. Counts, for
+        every arc (i, j) and every legal value x of i, the legal values of
+        j that support x, and then removes every value that has no
+        support from 'assignment'. Returns false if a variable is left
+        without legal values.
+        """
+        self.supports = {(j, y): [] for j in assignment for y in assignment[j]}
+        self.support_counters = {}
+        unsupported = []
+        for i in self.constraints:
+            for (j, pairs) in self.constraints[i].items():
+                for x in assignment[i]:
+                    count = 0
+                    for y in assignment[j]:
+                        if (x, y) in pairs:
+                            count += 1
+                            self.supports[(j, y)].append((i, x))
+                    self.support_counters[(i, j, x)] = count
+                    if count == 0:
+                        unsupported.append((i, x))
+
+        removed = []
+        for (i, x) in unsupported:
+            if x in assignment[i]:
+                assignment[i].remove(x)
+                trail.append((i, x))
+                removed.append((i, x))
+        return (all(assignment.values()) and
+            self.inference_ac4(assignment, removed, trail))
+
+    def inference_ac4(self, assignment, removed, trail):
+        """The propagation phase of the 'AC-4' algorithm. 'removed' is a
+        list of the (variable, value) pairs that have been deleted from
+        'assignment' since the support counters were last updated. The
+        counters of the values they supported are decreased, and every
+        value that is left without support is deleted as well and
+        recorded on 'trail'. Returns false if a variable is left without
+        legal values.
+        """
+        queue = []
+        for (j, y) in removed:
+            self.remove_support(j, y, queue)
+        while queue:
+            (i, x) = queue.pop()
+            if x in assignment[i]:
+                assignment[i].remove(x)
+                trail.append((i, x))
+                self.count_domain_change(i, len(assignment[i]) + 1,
+                    len(assignment[i]))
+                # update the counters before giving up, so that undo()
+                # always finds them consistent with the trail
+                self.remove_support(i, x, queue)
+                if not assignment[i]:
+                    return False
+        return True
+
+    def remove_support(self, j, y, queue):
+        """Decreases the counters of all the values supported by value 'y'
+        of variable 'j', appending the (variable, value) pairs that are
+        left without support to 'queue'.
+        """
+        for (i, x) in self.supports[(j, y)]:
+            self.support_counters[(i, j, x)] -= 1
+            if self.support_counters[(i, j, x)] == 0:
+                queue.append((i, x))
+
+    def get_domain_size(self, domain):
+        """Returns the number of legal values in 'domain'.
+        """
+        return len(domain)
+
     def get_edges_to(self, i, exclude):
         """Returns all the edges from the neighbors of i (except j) to i.
         """
-        edges = []
-        for x in self.constraints[i].keys():
-            if x != exclude:
-                edges.append((x, i))
+        edges = self.edges_to.get((i, exclude))
+        if edges is None:
+            edges = tuple((x, i) for x in self.constraints[i].keys()
+                if x != exclude)
+            self.edges_to[(i, exclude)] = edges
         # return all the edges from all the neighbors of i (except j) to i
         return edges
 
-    def revise(self, asg, i, j):
+    def revise(self, asg, i, j, trail=None):
         """The function 'Revise' from the pseudocode in the textbook.
         'assignment' is the current partial assignment, that contains
         the lists of legal values for each undecided variable. 'i' and
         'j' specifies the arc that should be visited. If a value is
         found in variable i's domain that doesn't satisfy the constraint
         between i and j, the value should be deleted from i's list of
-        legal values in 'assignment'.
-        """
-        revised = False
-        is_satisfied = False
-        # for every value x in the domain of i
-        for x in asg[i]:
-            # find at least one value y in the domain of j that satisfies the
-            # constraint
-            for y in asg[j]:
-                if (x, y) in self.constraints[i][j]:
-                    is_satisfied = True
-                    break
-                else:
-                    is_satisfied = False
-            # if no value is found
-            if not is_satisfied:
-                # then remove x (since it is not satisfied)
-                asg[i].remove(x)
-                # and make sure to revise again
-                revised = True
-        return revised
+        legal values in 'assignment'. If 'trail' is given, the pair
+        (i, value) is appended to it for every value that is deleted.
+        """
+        # an Alldiff arc only removes a value from i when it is the single
+        # value left for j
+        if (i, j) in self.all_different_arcs:
+            if len(asg[j]) == 1 and asg[j][0] in asg[i]:
+                asg[i].remove(asg[j][0])
+                if trail is not None:
+                    trail.append((i, asg[j][0]))
+                    self.count_domain_change(i, len(asg[i]) + 1, len(asg[i]))
+                return True
+            return False
+
+        supports = self.value_supports[i][j]
+        # keep every value x in the domain of i for which there is at least
+        # one value y in the domain of j that satisfies the constraint
+        domain = asg[i]
+        domain_j = asg[j]
+        satisfied = [x for x in domain
+            if not supports[x].isdisjoint(domain_j)]
+        # if every value is satisfied, there is nothing to revise
+        if len(satisfied) == len(domain):
+            return False
+        # otherwise remove the values that are not satisfied, and make sure
+        # to revise again
+        if trail is not None:
+            trail.extend((i, x) for x in domain if x not in satisfied)
+            self.count_domain_change(i, len(domain), len(satisfied))
+        asg[i] = satisfied
+        return True
+
+
+def propagate_all_different(domains, nbr_ptr, nbr_idx, queue, in_queue,
+                            queue_length):
+    """AC-3 for a CSP whose constraints are all Alldiff constraints, over
+    an array 'domains' of bitmasks. The neighbours of variable j are
+    nbr_idx[nbr_ptr[j]:nbr_ptr[j + 1]]. 'queue' is a ring buffer holding
+    'queue_length' variables whose arcs have to be revised, and
+    'in_queue' flags the variables that are in it. Every variable that
+    is left with a single value removes it from its neighbours. Returns
+    false if a variable is left without legal values.
+    """
+    n = len(domains)
+    head = 0
+    while queue_length > 0:
+        j = queue[head]
+        head = (head + 1) % n
+        queue_length -= 1
+        in_queue[j] = 0
+        mask = domains[j]
+        # only a single value left for j can remove values
+        if mask & (mask - 1):
+            continue
+        for k in range(nbr_ptr[j], nbr_ptr[j + 1]):
+            i = nbr_idx[k]
+            if domains[i] & mask:
+                domains[i] &= ~mask
+                if domains[i] == 0:
+                    return False
+                if not in_queue[i]:
+                    queue[(head + queue_length) % n] = i
+                    queue_length += 1
+                    in_queue[i] = 1
+    return True
+
+
+# the compiled version of propagate_all_different() that BitmaskCSP uses:
+# the Cython extension csp._ac3 when it has been built, otherwise the
+# function compiled by Numba, caching the result on disk so that it only
+# has to be compiled once
+if _ac3 is not None:
+    compiled_propagate_all_different = _ac3.propagate_all_different
+elif numba is not None:
+    compiled_propagate_all_different = numba.njit(cache=True)(
+        propagate_all_different)
+else:
+    compiled_propagate_all_different = None
+
+
+class BitmaskCSP(CSP):
+    """A CSP whose legal values are the integers 1, 2, ..., n for a small
+    n, as in Sudoku. The domain of a variable is stored as a single
+    integer, where bit k is set if the value k + 1 is legal, so that the
+    domains can be counted, copied and reduced with bitwise operations
+    instead of looping over lists of values.
+    """
+    __slots__ = ('all_different_cliques', 'variable_cliques',
+        'neighbour_arrays')
+
+    def __init__(self):
+        super().__init__()
+
+        # self.domains[i] is a bitmask of the legal values for variable i
+
+        # self.constraints[i][j] is a dictionary that maps every value x
+        # of variable i to the bitmask of the values of variable j that
+        # form a legal pair with x
+
+        # self.all_different_cliques is a list of the lists of variables
+        # of every Alldiff constraint, and self.variable_cliques maps every
+        # variable to the indices of the Alldiff constraints it is in (see
+        # get_variable_cliques())
+        self.all_different_cliques = []
+        self.variable_cliques = None
+
+        # arrays used by compiled_propagate_all_different(), see
+        # get_neighbour_arrays()
+        self.neighbour_arrays = None
+
+    @staticmethod
+    def get_values(mask):
+        """Get a list of the values whose bits are set in 'mask',
+        from lowest to highest.
+        """
+        values = []
+        while mask:
+            bit = mask & -mask
+            values.append(bit.bit_length())
+            mask ^= bit
+        return values
+
+    @staticmethod
+    def get_mask(domain):
+        """Get the bitmask with the bits of the values in 'domain' set."""
+        mask = 0
+        for value in domain:
+            mask |= 1 << (value - 1)
+        return mask
+
+    def add_variable(self, name, domain):
+        """Add a new variable to the CSP. 'name' is the variable name
+        and 'domain' is a list of the legal values for the variable,
+        which are stored as a bitmask.
+        """
+        self.add_variable_bitmask(name, self.get_mask(domain))
+
+    def add_variable_bitmask(self, name, mask):
+        """Add a new variable to the CSP. 'name' is the variable name
+        and 'mask' is the bitmask of the legal values for the variable.
+        """
+        self.variables.append(name)
+        self.domains[name] = mask
+        self.constraints[name] = {}
+        self.variable_cliques = None
+        self.neighbour_arrays = None
+
+    def add_variables_bulk(self, names, domains):
+        """Add all the variables in the list 'names' to the CSP at once,
+        as in CSP.add_variables_bulk(), storing the domains as bitmasks.
+        """
+        self.add_variables_bitmask(
+            names, [self.get_mask(domain) for domain in domains])
+
+    def add_variables_bitmask(self, names, masks):
+        """Add all the variables in the list 'names' to the CSP at once,
+        where masks[k] is the bitmask of the legal values for names[k].
+        """
+        self.variables.extend(names)
+        self.domains.update(zip(names, masks))
+        self.constraints.update((name, {}) for name in names)
+        self.variable_cliques = None
+        self.neighbour_arrays = None
+
+    def copy_domains(self):
+        """Get a copy of the dictionary of the domains of the variables.
+        The bitmasks are integers, so they do not have to be copied.
+        """
+        return dict(self.domains)
+
+    def add_constraint_one_way(self, i, j, filter_function):
+        """Add a new constraint between variables 'i' and 'j', as in
+        CSP.add_constraint_one_way(), storing for every value of 'i' the
+        bitmask of the values of 'j' that it can be paired with.
+        """
+        if filter_function is NEQ and ((i, j) in self.all_different_arcs
+                or j not in self.constraints[i]):
+            # CSP.add_constraint_one_way() makes the arc an Alldiff arc
+            super().add_constraint_one_way(i, j, filter_function)
+            return
+
+        self.all_different_arcs.discard((i, j))
+        self.neighboring_arcs.clear()
+        self.edges_to.clear()
+        self.variable_cliques = None
+        self.neighbour_arrays = None
+
+        if j in self.constraints[i]:
+            candidates = self.constraints[i][j]
+        else:
+            candidates = {x: self.domains[j]
+                for x in self.get_values(self.domains[i])}
+
+        # the bitmasks are stored in a new dictionary, as the one on the
+        # arc can be shared with other arcs (see add_shared_constraint())
+        supports = {}
+        for (x, mask) in candidates.items():
+            for y in self.get_values(mask):
+                if not filter_function(x, y):
+                    mask &= ~(1 << (y - 1))
+            supports[x] = mask
+        self.constraints[i][j] = supports
+
+    def add_shared_constraint(self, i, j, supports):
+        """Add a new constraint between variables 'i' and 'j', as in
+        CSP.add_shared_constraint(), where 'supports' is a dictionary that
+        maps every value of 'i' to the bitmask of the values of 'j' that
+        it can be paired with. The dictionary is not copied and must not
+        be modified afterwards.
+        """
+        self.all_different_arcs.discard((i, j))
+        self.neighboring_arcs.clear()
+        self.edges_to.clear()
+        self.variable_cliques = None
+        self.neighbour_arrays = None
+        self.constraints[i][j] = supports
+
+    def get_all_different_constraint(self, i, j):
+        """Get the bitmasks of the values of variable 'j' that differ from
+        every value of variable 'i', as in
+        CSP.get_all_different_constraint().
+        """
+        key = (self.domains[i], self.domains[j])
+        if key not in self.shared_constraints:
+            self.shared_constraints[key] = {x: self.domains[j] & ~(1 << (x - 1))
+                for x in self.get_values(self.domains[i])}
+        return self.shared_constraints[key]
+
+    def add_all_different_constraint(self, variables):
+        """Add an Alldiff constraint between all of the variables in the
+        list 'variables', as in CSP.add_all_different_constraint(), and
+        remember the variables of the constraint.
+        """
+        super().add_all_different_constraint(variables)
+        self.all_different_cliques.append(list(variables))
+        self.variable_cliques = None
+
+    def get_variable_cliques(self):
+        """Get a dictionary that maps every variable to the indices of the
+        Alldiff constraints in 'all_different_cliques' that it is in.
+        Returns None if some constraint is not an Alldiff constraint.
+        """
+        if self.variable_cliques is None:
+            self.variable_cliques = False
+            # every arc has to be an Alldiff arc of one of the cliques
+            clique_arcs = set()
+            for clique in self.all_different_cliques:
+                clique_arcs.update(itertools.permutations(clique, 2))
+            if clique_arcs <= self.all_different_arcs and \
+                    len(clique_arcs) == len(self.get_all_arcs()):
+                self.variable_cliques = {var: [] for var in self.variables}
+                for (k, clique) in enumerate(self.all_different_cliques):
+                    for var in clique:
+                        self.variable_cliques[var].append(k)
+        return self.variable_cliques or None
+
+    def get_neighbour_arrays(self):
+        """Get the arrays that describe the constraint graph to
+        propagate_all_different(), i.e. a dictionary with the index of
+        every variable, the 'nbr_ptr' and 'nbr_idx' arrays of the
+        neighbours of every variable, and the buffer of the queue.
+        Returns None if some constraint is not an Alldiff constraint, or
+        if some domain does not fit in a 64 bit integer.
+        """
+        if self.neighbour_arrays is None:
+            self.neighbour_arrays = False
+            if self.get_variable_cliques() is None:
+                return None
+            if any(mask >> 63 for mask in self.domains.values()):
+                return None
+            index = {var: k for (k, var) in enumerate(self.variables)}
+            nbr_ptr = [0]
+            nbr_idx = []
+            for var in self.variables:
+                nbr_idx.extend(index[x] for x in self.constraints[var])
+                nbr_ptr.append(len(nbr_idx))
+            self.neighbour_arrays = (index,
+                array.array('i', nbr_ptr),
+                array.array('i', nbr_idx),
+                array.array('i', bytes(4 * len(self.variables))))
+        return self.neighbour_arrays or None
+
+    def inference(self, assignment, queue, trail=None):
+        """The function 'AC-3' from the pseudocode in the textbook, as in
+        CSP.inference(). When all the constraints are Alldiff constraints,
+        the arcs are revised by propagate_all_different() if it has been
+        compiled (with Cython or Numba), or by propagate_cliques().
+        """
+        if not self.variables or self.get_variable_cliques() is None:
+            return super().inference(assignment, queue, trail)
+        arrays = None
+        if compiled_propagate_all_different is not None:
+            arrays = self.get_neighbour_arrays()
+        if arrays is None:
+            return self.propagate_cliques(assignment, queue, trail)
+
+        (index, nbr_ptr, nbr_idx, buffer) = arrays
+        domains = array.array('q', [assignment[var] for var in self.variables])
+        in_queue = array.array('B', bytes(len(self.variables)))
+        # start from the variables that the arcs in the queue go to
+        queue_length = 0
+        for (i, j) in queue:
+            if not in_queue[index[j]]:
+                buffer[queue_length] = index[j]
+                in_queue[index[j]] = 1
+                queue_length += 1
+        queue.clear()
+        consistent = compiled_propagate_all_different(domains, nbr_ptr,
+            nbr_idx, buffer, in_queue, queue_length)
+
+        # copy the reduced bitmasks back into the assignment
+        for (var, mask) in zip(self.variables, domains.tolist()):
+            if mask != assignment[var]:
+                if trail is not None:
+                    self.record(trail, var, assignment[var], mask)
+                assignment[var] = mask
+        return consistent
+
+    def propagate_cliques(self, assignment, queue, trail=None):
+        """AC-3 for a CSP whose constraints are all Alldiff constraints,
+        revising all the arcs of an Alldiff constraint at once: the values
+        of the variables of the constraint that have been decided are
+        removed from the rest of its variables in a single sweep. The
+        constraints of the variables that the arcs in 'queue' go to are
+        revised first, and then every constraint where a variable gets
+        decided, until nothing changes. Returns false if a variable is
+        left without legal values, or if two variables of a constraint
+        are decided to have the same value.
+        """
+        variable_cliques = self.get_variable_cliques()
+        dirty = set()
+        for (i, j) in queue:
+            dirty.update(variable_cliques[j])
+        queue.clear()
+        while dirty:
+            clique = self.all_different_cliques[dirty.pop()]
+            # the bitmask of the values of the decided variables
+            decided = 0
+            for var in clique:
+                mask = assignment[var]
+                if not mask & (mask - 1):
+                    if mask & decided:
+                        return False
+                    decided |= mask
+            if not decided:
+                continue
+            for var in clique:
+                mask = assignment[var]
+                if mask & (mask - 1) and mask & decided:
+                    revised = mask & ~decided
+                    if trail is not None:
+                        self.record(trail, var, mask, revised)
+                    assignment[var] = revised
+                    if not revised:
+                        return False
+                    # the variable is decided now, so its value has to be
+                    # removed from the other constraints it is in as well
+                    if not revised & (revised - 1):
+                        dirty.update(variable_cliques[var])
+        return True
+
+    def get_domain_size(self, domain):
+        """Returns the number of legal values in 'domain', i.e. the number
+        of bits that are set in the bitmask.
+        """
+        return domain.bit_count()
+
+    def assign(self, assignment, var, value, trail):
+        """Adds { var = value } to 'assignment', recording the previous
+        bitmask of variable 'var' on 'trail'.
+        """
+        self.record(trail, var, assignment[var], 1 << (value - 1))
+        assignment[var] = 1 << (value - 1)
+
+    def initialize_supports(self, assignment, trail):
+        """AC-4 works on lists of legal values, so it can not be selected
+        with 'inference_strategy_ac4' for a BitmaskCSP.
+        """
+        raise ValueError("AC-4 is not available for BitmaskCSP, "
+            "set inference_strategy_ac4 to False")
+
+    def record(self, trail, var, mask, revised):
+        """Appends the bitmask 'mask' of variable 'var' to 'trail' before
+        it is replaced by the bitmask 'revised', and counts the change of
+        its number of legal values.
+        """
+        trail.append((var, mask))
+        self.count_domain_change(var, mask.bit_count(), revised.bit_count())
+
+    def undo(self, assignment, trail, mark):
+        """Restores the bitmasks that were replaced in 'assignment' since
+        the trail had length 'mark', and shortens the trail back to that
+        length.
+        """
+        while len(trail) > mark:
+            (var, mask) = trail.pop()
+            self.count_domain_change(var, assignment[var].bit_count(),
+                mask.bit_count())
+            assignment[var] = mask
+
+    def select_unassigned_variable(self, assignment):
+        """Returns the name of one of the variables in 'assignment' that
+        have not yet been decided, as in
+        CSP.select_unassigned_variable().
+        """
+        if self.select_unassigned_strategy_static:
+            for var in assignment.keys():
+                mask = assignment[var]
+                if mask & (mask - 1):
+                    return var
+        return super().select_unassigned_variable(assignment)
+
+    def degree_heuristic(self, assignment):
+        """Returns the variable with the highest number of constraints.
+        """
+        max_var = None
+        max_value = None
+        for var in self.constraints.keys():
+            mask = assignment[var]
+            if mask & (mask - 1):
+                if max_value is None or max_value < len(self.constraints[var]):
+                    max_var = var
+                    max_value = len(self.constraints[var])
+        return max_var
+
+    def order_domain_values(self, var, asg):
+        """Returns a list of the domain values of the variable 'var' for
+        assignment 'asg'.
+        """
+        values = self.get_values(self.domains[var])
+        if self.order_domain_values_strategy_static:
+            return values
+        elif self.order_domain_values_strategy_least_constraint:
+            # sort the values by the number of neighbours that still have
+            # them as a legal value
+            return sorted(values, key=lambda value: sum(
+                1 for c in self.constraints[var] if asg[c] >> (value - 1) & 1))
+
+    def is_consistent(self, val, var, asg):
+        """Returns true if value 'val' is consistent with the assignment 'asg'.
+        """
+        for (var2, supports) in self.constraints[var].items():
+            # there has to be a legal value left for 'var2' that can be
+            # paired with 'val'
+            if not supports.get(val, 0) & asg[var2]:
+                return False
+        return True
+
+    def revise(self, asg, i, j, trail=None):
+        """The function 'Revise' from the pseudocode in the textbook, as
+        in CSP.revise(). Removes the bits of all the values of variable
+        'i' that have no legal pair among the values of variable 'j'. If
+        'trail' is given, the previous bitmask of 'i' is appended to it.
+        """
+        mask = asg[i]
+        domain_j = asg[j]
+        if (i, j) in self.all_different_arcs:
+            # a value of 'i' only loses its support when it is the single
+            # value left for 'j'
+            if domain_j & (domain_j - 1):
+                return False
+            revised = mask & ~domain_j
+        else:
+            supports = self.constraints[i][j]
+            revised = mask
+            for x in self.get_values(mask):
+                if not supports.get(x, 0) & domain_j:
+                    revised &= ~(1 << (x - 1))
+        if revised == mask:
+            return False
+        if trail is not None:
+            self.record(trail, i, mask, revised)
+        asg[i] = revised
+        return True
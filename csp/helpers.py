@@ -1,4 +1,35 @@
-import os
+import sys
+from pathlib import Path
+
+from . import csp_solver
+
+try:
+    from . import _sudoku_csolve
+except ImportError:
+    _sudoku_csolve = None
+
+
+def build_sudoku_units():
+    """Get a list of the 27 lists of cells of a Sudoku board that must
+    have different values, i.e. the rows, the columns and the boxes.
+    """
+    units = []
+    for row in range(9):
+        units.append([row * 9 + col for col in range(9)])
+    for col in range(9):
+        units.append([row * 9 + col for row in range(9)])
+    for box_row in range(3):
+        for box_col in range(3):
+            cells = []
+            for row in range(box_row * 3, (box_row + 1) * 3):
+                for col in range(box_col * 3, (box_col + 1) * 3):
+                    cells.append(row * 9 + col)
+            units.append(cells)
+    return units
+
+
+# the units are the same for every board, so they are only built once
+SUDOKU_UNITS = build_sudoku_units()
 
 
 def backtracking_search_sudoku(file, csp):
@@ -7,7 +38,10 @@ def backtracking_search_sudoku(file, csp):
     """
     print(file)
     csp = create_sudoku_csp(file, csp)
-    solution = csp.backtracking_search()
+    if can_solve_in_c(csp):
+        solution = solve_in_c(csp)
+    else:
+        solution = csp.backtracking_search()
     if solution is not None:
         print_sudoku_solution(solution)
     print("BACKTRACK being called count: ", csp.backtrack_calls_count)
@@ -15,50 +49,68 @@ def backtracking_search_sudoku(file, csp):
           csp.backtrack_returns_failure_count)
 
 
+def can_solve_in_c(csp):
+    """Returns true if the C extension _sudoku_csolve has been built and
+    runs the same search as csp.backtracking_search(), i.e. if 'csp' is a
+    BitmaskCSP with the default strategies.
+    """
+    return (_sudoku_csolve is not None
+        and type(csp) is csp_solver.BitmaskCSP
+        and not csp.select_unassigned_strategy_static
+        and csp.select_unassigned_strategy_mrv
+        and csp.select_unassigned_strategy_degree
+        and not csp.order_domain_values_strategy_static
+        and csp.order_domain_values_strategy_least_constraint
+        and not csp.inference_strategy_ac4
+        and csp.backtrack_calls_count == 0)
+
+
+def solve_in_c(csp):
+    """Run the search on the Sudoku board of 'csp' with the C extension
+    _sudoku_csolve, and return the solution as csp.backtracking_search()
+    does. The counters of 'csp' are updated with the counts of the search.
+    """
+    board = bytes(ord('0') + (mask.bit_length() if mask & (mask - 1) == 0
+        else 0) for mask in map(csp.domains.get, range(81)))
+    (solution, calls, failures) = _sudoku_csolve.solve(board)
+    csp.backtrack_calls_count += calls
+    csp.backtrack_returns_failure_count += failures
+    if solution is None:
+        return None
+    return {cell: 1 << (digit - ord('1')) for (cell, digit) in
+        enumerate(solution)}
+
+
 def create_sudoku_csp(filename, csp):
-    """Instantiate a CSP representing the Sudoku board found in the text
-    file named 'filename' in the boards directory.
+    """Instantiate a BitmaskCSP representing the Sudoku board found in
+    the text file named 'filename', relative to the directory of this
+    module.
     """
-    path = os.path.realpath(__file__)
-    dir = os.path.dirname(path)
-    dir.join("boards")
-    os.chdir(dir)
-    board = list(map(lambda x: x.strip(), open(filename, 'r')))
-    for row in range(9):
-        for col in range(9):
-            if board[row][col] == '0':
-                csp.add_variable('%d-%d' % (row, col),
-                                 list(map(str, range(1, 10))))
-            else:
-                csp.add_variable('%d-%d' % (row, col), [board[row][col]])
+    # the digits of the board as bytes, without the line breaks, so that
+    # board[row * 9 + col] is the code of the digit of the cell
+    board = b''.join((Path(__file__).parent / filename).read_bytes().split())
+    # the empty cells can take any value, and the given ones only their
+    # own digit
+    csp.add_variables_bitmask(list(range(81)),
+        [0x1FF if digit == ord('0') else 1 << (digit - ord('1'))
+            for digit in board[:81]])
 
-    for row in range(9):
-        csp.add_all_different_constraint(
-            ['%d-%d' % (row, col) for col in range(9)])
-    for col in range(9):
-        csp.add_all_different_constraint(
-            ['%d-%d' % (row, col) for row in range(9)])
-    for box_row in range(3):
-        for box_col in range(3):
-            cells = []
-            for row in range(box_row * 3, (box_row + 1) * 3):
-                for col in range(box_col * 3, (box_col + 1) * 3):
-                    cells.append('%d-%d' % (row, col))
-            csp.add_all_different_constraint(cells)
+    for unit in SUDOKU_UNITS:
+        csp.add_all_different_constraint(unit)
 
     return csp
 
 
 def print_sudoku_solution(solution):
     """Convert the representation of a Sudoku solution as returned from
-    the method CSP.backtracking_search(), into a human readable
-    representation.
+    the method BitmaskCSP.backtracking_search(), into a human readable
+    representation. The whole board is written to stdout at once.
     """
+    lines = []
     for row in range(9):
-        for col in range(9):
-            print(solution['%d-%d' % (row, col)][0], end=" "),
-            if col == 2 or col == 5:
-                print('|', end=" "),
-        print("")
+        cells = [str(solution[row * 9 + col].bit_length()) for col in range(9)]
+        lines.append(' | '.join(
+            ' '.join(cells[col:col + 3]) for col in (0, 3, 6)) + ' ')
         if row == 2 or row == 5:
-            print('------+-------+------')
+            lines.append('------+-------+------')
+    sys.stdout.write('\n'.join(lines) + '\n')
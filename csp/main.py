@@ -1,18 +1,47 @@
-import argparse
-import csp_solver
-import helpers
+import contextlib
+import io
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# import the modules through the 'csp' package, as the tests do, so that
+# they are only ever loaded under one name (which Numba's on-disk cache of
+# compiled functions relies on)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from csp import csp_solver
+from csp import helpers
+
+
+def solve_board(file):
+    """Solve the sudoku board matching 'file' with a new CSP and return
+    the output of helpers.backtracking_search_sudoku().
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        helpers.backtracking_search_sudoku(file, csp_solver.BitmaskCSP())
+    return output.getvalue()
 
 
 def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--level",
-        help="specify sudoku level: easy, medium, hard or veryhard")
-    args = parser.parse_args()
-    if not args.level:
+    # the sudoku level (easy, medium, hard, veryhard or all) is given with
+    # the only option, '--level'
+    level = None
+    if "--level" in sys.argv[1:-1]:
+        level = sys.argv[sys.argv.index("--level") + 1]
+    if not level:
         print("Sudoku board level missing")
+    elif level == "all":
+        # solve every board in its own process, and print the results in
+        # the order of the boards
+        boards = sorted(Path(__file__).parent.glob("boards/*.txt"))
+        files = [f"boards/{board.name}" for board in boards]
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for output in executor.map(solve_board, files):
+                print(output, end="")
     else:
-        csp = csp_solver.CSP()
-        helpers.backtracking_search_sudoku(f"boards/{args.level}.txt", csp)
+        csp = csp_solver.BitmaskCSP()
+        helpers.backtracking_search_sudoku(f"boards/{level}.txt", csp)
 
 
 if __name__ == "__main__":
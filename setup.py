@@ -1,12 +1,31 @@
-from setuptools import setup, find_packages
+from setuptools import setup, find_packages, Extension
 
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    cythonize = None
 
-with open('README.md') as f:
+
+with open('readme.md') as f:
     readme = f.read()
 
 with open('LICENSE') as f:
     license = f.read()
 
+# The C version of the Sudoku search is optional: helpers falls back to
+# the Python search when it can not be built
+ext_modules = [
+    Extension('csp._sudoku_csolve', ['csp/_sudoku_csolve.c'], optional=True,
+        extra_compile_args=['-O3'])]
+
+# The Cython version of the Sudoku constraint propagation is optional: it
+# is only built when Cython is installed, and the solver falls back to
+# Numba or plain Python without it
+if cythonize is not None:
+    ext_modules += cythonize(
+        [Extension('csp._ac3', ['csp/_ac3.pyx'], optional=True)],
+        language_level=3)
+
 setup(
     name='CSP',
     version='0.1.0',
@@ -16,5 +35,7 @@ setup(
     author_email='s@saragarci.com',
     url='https://github.com/saragarci/csp',
     license=license,
-    packages=find_packages(exclude=('tests'))
+    packages=find_packages(exclude=('tests')),
+    python_requires='>=3.10',
+    ext_modules=ext_modules
 )
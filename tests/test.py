@@ -1,7 +1,9 @@
 from csp import csp_solver
+from csp import helpers
 
 import unittest
 import copy
+import operator
 
 
 class CSPSolverTestSuite(unittest.TestCase):
@@ -15,6 +17,14 @@ class CSPSolverTestSuite(unittest.TestCase):
         self.letters_numbers_assignment.add_all_different_constraint(
             ['A', 'B', 'C'])
 
+        # Problem 1 with the domains stored as bitmasks
+        self.letters_numbers_bitmask = csp_solver.BitmaskCSP()
+        self.letters_numbers_bitmask.add_variable('A', [1, 2, 3])
+        self.letters_numbers_bitmask.add_variable('B', [2])
+        self.letters_numbers_bitmask.add_variable('C', [3])
+        self.letters_numbers_bitmask.add_all_different_constraint(
+            ['A', 'B', 'C'])
+
         # Problem 2
         # Assign a color to each number with 'diff all' constraint
         self.numbers_colors_assignment = csp_solver.CSP()
@@ -41,10 +51,10 @@ class CSPSolverTestSuite(unittest.TestCase):
         }
         for state, other_states in edges.items():
             for other_state in other_states:
-                csp.add_constraint_one_way(state, other_state, 
-                                           lambda i, j: i != j)
+                csp.add_constraint_one_way(state, other_state,
+                                           csp_solver.NEQ)
                 csp.add_constraint_one_way(other_state, state,
-                                           lambda i, j: i != j)
+                                           csp_solver.NEQ)
 
     def create_map_coloring_csp(self, csp):
         states = ['WA', 'NT', 'Q', 'NSW', 'V', 'SA', 'T']
@@ -58,10 +68,10 @@ class CSPSolverTestSuite(unittest.TestCase):
             csp.add_variable(state, colors)
         for state, other_states in edges.items():
             for other_state in other_states:
-                csp.add_constraint_one_way(state, other_state, 
-                                           lambda i, j: i != j)
+                csp.add_constraint_one_way(state, other_state,
+                                           csp_solver.NEQ)
                 csp.add_constraint_one_way(other_state, state,
-                                           lambda i, j: i != j)
+                                           csp_solver.NEQ)
 
     def test_csp_sets_constraints_correctly(self):
         self.assertEqual(self.letters_numbers_assignment.variables, 
@@ -71,21 +81,78 @@ class CSPSolverTestSuite(unittest.TestCase):
             'A': [1, 2, 3], 'B': [2], 'C': [3]
         })
         self.assertEqual(self.letters_numbers_assignment.constraints, {
-            'A': {'B': [(1, 2), (3, 2)], 'C': [(1, 3), (2, 3)]},
-            'B': {'A': [(2, 1), (2, 3)], 'C': [(2, 3)]},
-            'C': {'A': [(3, 1), (3, 2)], 'B': [(3, 2)]}
+            'A': {'B': {(1, 2), (3, 2)}, 'C': {(1, 3), (2, 3)}},
+            'B': {'A': {(2, 1), (2, 3)}, 'C': {(2, 3)}},
+            'C': {'A': {(3, 1), (3, 2)}, 'B': {(3, 2)}}
         })
+        self.assertEqual(self.letters_numbers_assignment.value_supports, {
+            'A': {'B': {1: {2}, 2: set(), 3: {2}},
+                  'C': {1: {3}, 2: {3}, 3: set()}},
+            'B': {'A': {2: {1, 3}}, 'C': {2: {3}}},
+            'C': {'A': {3: {1, 2}}, 'B': {3: {2}}}
+        })
+
+    def test_add_variables_bulk_matches_add_variable(self):
+        for cls in [csp_solver.CSP, csp_solver.BitmaskCSP]:
+            csp = cls()
+            csp.add_variables_bulk(['A', 'B', 'C'], [[1, 2, 3], [2], [3]])
+            csp.add_all_different_constraint(['A', 'B', 'C'])
+            expected = (self.letters_numbers_bitmask
+                if cls is csp_solver.BitmaskCSP
+                else self.letters_numbers_assignment)
+            self.assertEqual(csp.variables, expected.variables)
+            self.assertEqual(csp.domains, expected.domains)
+            self.assertEqual(csp.constraints, expected.constraints)
+
+    def test_all_different_arcs_share_their_constraint(self):
+        csp = csp_solver.CSP()
+        for var in ['X', 'Y', 'Z']:
+            csp.add_variable(var, [1, 2])
+        csp.add_all_different_constraint(['X', 'Y', 'Z'])
+        self.assertEqual(csp.constraints['X']['Y'], {(1, 2), (2, 1)})
+        self.assertIs(csp.constraints['X']['Y'], csp.constraints['Z']['X'])
+        self.assertIs(csp.value_supports['X']['Y'],
+            csp.value_supports['Z']['X'])
 
     def test_AC3_algorithm_on_problem_1(self):
-        assignment = copy.deepcopy(self.letters_numbers_assignment.domains)
+        assignment = self.letters_numbers_assignment.copy_domains()
         queue = [('C', 'A'), ('C', 'B'), ('B', 'A'), ('B', 'C'),
             ('A', 'B'), ('A', 'C')]
         self.letters_numbers_assignment.inference(assignment, queue)
         self.assertEqual(queue, [])
         self.assertEqual(assignment, {'A': [1], 'B': [2], 'C': [3]})
 
+    def test_bitmask_csp_sets_constraints_correctly(self):
+        self.assertEqual(self.letters_numbers_bitmask.domains, {
+            'A': 0b111, 'B': 0b010, 'C': 0b100
+        })
+        self.assertEqual(self.letters_numbers_bitmask.constraints, {
+            'A': {'B': {1: 0b010, 2: 0b000, 3: 0b010},
+                  'C': {1: 0b100, 2: 0b100, 3: 0b000}},
+            'B': {'A': {2: 0b101}, 'C': {2: 0b100}},
+            'C': {'A': {3: 0b011}, 'B': {3: 0b010}}
+        })
+
+    def test_AC3_algorithm_on_bitmask_problem_1(self):
+        assignment = self.letters_numbers_bitmask.copy_domains()
+        queue = [('C', 'A'), ('C', 'B'), ('B', 'A'), ('B', 'C'),
+            ('A', 'B'), ('A', 'C')]
+        self.letters_numbers_bitmask.inference(assignment, queue)
+        self.assertEqual(queue, [])
+        self.assertEqual(assignment, {'A': 0b001, 'B': 0b010, 'C': 0b100})
+
+    def test_bitmask_csp_rebuilds_neighbour_arrays_for_new_variables(self):
+        csp = self.letters_numbers_bitmask
+        csp.get_neighbour_arrays()
+        csp.add_variable('D', [1, 2, 3])
+        csp.add_variables_bitmask(['E'], [0b111])
+        (index, nbr_ptr, nbr_idx, buffer) = csp.get_neighbour_arrays()
+        self.assertEqual(len(nbr_ptr), 6)
+        self.assertEqual(len(buffer), 5)
+        self.assertEqual(len(csp.get_variable_cliques()), 5)
+
     def test_AC3_algorithm_on_problem_2(self):
-        assignment = copy.deepcopy(self.numbers_colors_assignment.domains)
+        assignment = self.numbers_colors_assignment.copy_domains()
         queue = [('1', '3'), ('1', '2'), ('2', '1'), ('2', '3'), ('2', '4'),
                 ('4', '2'), ('4', '3'), ('4', '5'), ('3', '1'), ('3', '2'), 
                 ('3', '5'), ('3', '4'), ('5', '3'), ('5', '4')]
@@ -94,6 +161,38 @@ class CSPSolverTestSuite(unittest.TestCase):
         self.assertEqual(assignment, {'1': ['R'], '2': ['G', 'B'], 
             '3': ['G', 'B'], '4': ['R', 'G', 'B'], '5': ['R', 'B']})
 
+    def test_AC3_algorithm_on_all_different_arcs_with_other_constraints(self):
+        for (csp, expected) in [
+                (csp_solver.CSP(), {'A': [2, 3], 'B': [1, 2]}),
+                (csp_solver.BitmaskCSP(), {'A': 0b110, 'B': 0b011})]:
+            csp.add_variable('A', [1, 2, 3])
+            csp.add_variable('B', [1, 2, 3])
+            csp.add_constraint_one_way('A', 'B', operator.gt)
+            csp.add_constraint_one_way('B', 'A', operator.lt)
+            csp.add_all_different_constraint(['A', 'B'])
+            assignment = csp.copy_domains()
+            csp.inference(assignment, [('A', 'B'), ('B', 'A')])
+            self.assertEqual(assignment, expected)
+
+    def test_revise_removes_every_unsupported_value(self):
+        csp = csp_solver.CSP()
+        csp.add_variable('A', [1, 2, 3])
+        csp.add_variable('B', [3])
+        csp.add_constraint_one_way('A', 'B', operator.gt)
+        assignment = csp.copy_domains()
+        self.assertTrue(csp.revise(assignment, 'A', 'B'))
+        self.assertEqual(assignment, {'A': [], 'B': [3]})
+
+    def test_NEQ_only_makes_unconstrained_arcs_all_different(self):
+        csp = csp_solver.CSP()
+        csp.add_variable('A', [1, 2, 3])
+        csp.add_variable('B', [1, 2, 3])
+        csp.add_constraint_one_way('A', 'B', csp_solver.NEQ)
+        csp.add_constraint_one_way('B', 'A', operator.gt)
+        csp.add_constraint_one_way('B', 'A', csp_solver.NEQ)
+        self.assertEqual(csp.all_different_arcs, {('A', 'B')})
+        self.assertEqual(csp.constraints['B']['A'], {(2, 1), (3, 1), (3, 2)})
+
     def test_backtracking_search_on_problem_2(self):
         solution = self.numbers_colors_assignment.backtracking_search()
         self.assertEqual(solution, {'1': ['R'], '2': ['B'], '3': ['G'], 
@@ -111,6 +210,53 @@ class CSPSolverTestSuite(unittest.TestCase):
         self.assertEqual(self.map_coloring.backtrack_calls_count, 4)
         self.assertEqual(self.map_coloring.backtrack_returns_failure_count, 0)
 
+    def test_backtracking_search_with_AC4_on_problem_3(self):
+        self.map_coloring.inference_strategy_ac4 = True
+        solution = self.map_coloring.backtracking_search()
+        self.assertEqual(solution, {'WA': ['green'], 'NT': ['blue'], 
+                         'Q': ['green'], 'NSW': ['blue'], 'V': ['green'],
+                         'SA': ['red'], 'T': ['red']})
+        self.assertEqual(self.map_coloring.backtrack_calls_count, 4)
+        self.assertEqual(self.map_coloring.backtrack_returns_failure_count, 0)
+
+    def test_backtracking_search_with_AC4_that_backtracks(self):
+        # the first value of '0' fails, so the support counters have to be
+        # restored before the search carries on
+        results = []
+        for ac4 in [False, True]:
+            csp = csp_solver.CSP()
+            for var in ['0', '1', '2', '3', '4']:
+                csp.add_variable(var, ['B', 'G', 'R'])
+            csp.domains['0'] = csp.domains['4'] = ['G', 'R']
+            for (i, j) in [('0', '2'), ('0', '4'), ('1', '2'), ('1', '3'),
+                    ('1', '4'), ('2', '4')]:
+                csp.add_constraint_one_way(i, j, csp_solver.NEQ)
+                csp.add_constraint_one_way(j, i, csp_solver.NEQ)
+            csp.inference_strategy_ac4 = ac4
+            results.append((csp.backtracking_search(),
+                csp.backtrack_calls_count,
+                csp.backtrack_returns_failure_count))
+        self.assertEqual(results[1], results[0])
+        self.assertEqual(results[1][0], {'0': ['G'], '1': ['G'], '2': ['B'],
+            '3': ['B'], '4': ['R']})
+        self.assertEqual(results[1][1:], (4, 1))
+
+    def test_backtracking_search_with_AC4_on_bitmask_csp_raises(self):
+        self.letters_numbers_bitmask.inference_strategy_ac4 = True
+        with self.assertRaises(ValueError):
+            self.letters_numbers_bitmask.backtracking_search()
+
+    @unittest.skipIf(helpers._sudoku_csolve is None,
+        "the C extension _sudoku_csolve has not been built")
+    def test_sudoku_C_search_matches_backtracking_search(self):
+        csp = helpers.create_sudoku_csp('boards/veryhard.txt',
+            csp_solver.BitmaskCSP())
+        c_csp = copy.deepcopy(csp)
+        self.assertTrue(helpers.can_solve_in_c(c_csp))
+        self.assertEqual(helpers.solve_in_c(c_csp), csp.backtracking_search())
+        self.assertEqual(c_csp.backtrack_calls_count, 41)
+        self.assertEqual(c_csp.backtrack_returns_failure_count, 27)
+
 
 if __name__ == "__main__":
     unittest.main()